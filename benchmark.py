@@ -0,0 +1,279 @@
+"""
+Benchmark suite for the trees in binary_tree.py.
+Sweeps tree size and key distribution, times every operation of each tree engine along with baselines built on
+bisect, NumPy and dict, and writes the results as JSON so that two runs (e.g. two releases) can be compared:
+    python benchmark.py --sizes 1000 10000 100000 --output new.json
+    python benchmark.py --sizes 1000 10000 100000 --output new.json --compare old.json
+"""
+
+import argparse
+import bisect
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import binary_tree as bt
+
+ENGINES = {"BT_Tree": bt.BT_Tree, "RB_Tree": bt.RB_Tree, "BT_ArrayTree": bt.BT_ArrayTree, "BT_BTree": bt.BT_BTree}
+DISTRIBUTIONS = ("uniform", "sorted", "reverse", "zipf", "duplicates")
+OPERATIONS = ("add", "from_keys", "find_node", "nearest", "find_kth", "range", "iterate", "print")
+
+# Largest tree built by adding sorted or heavily duplicated keys to an unbalanced tree, which takes O(n^2)
+MAX_UNBALANCED_SORTED = 2 ** 14
+
+
+def make_keys(distribution:str="uniform", n:int=0, rng:np.random.Generator=None) -> np.ndarray:
+    """
+    Generate keys with a given distribution.
+    :param distribution: one of DISTRIBUTIONS
+    :param n: number of keys
+    :param rng: NumPy random generator
+    :return: array of n integer keys
+    """
+    if distribution == "uniform":
+        return rng.integers(low=0, high=10 * n, size=n)
+    elif distribution == "sorted":
+        return np.sort(rng.integers(low=0, high=10 * n, size=n))
+    elif distribution == "reverse":
+        return np.sort(rng.integers(low=0, high=10 * n, size=n))[::-1]
+    elif distribution == "zipf":
+        return np.minimum(rng.zipf(a=1.5, size=n), 10 * n)
+    elif distribution == "duplicates":
+        return rng.integers(low=0, high=16, size=n)
+    raise ValueError(f"unknown distribution {distribution}")
+
+
+def best_time(function, repeat:int=1) -> float:
+    """
+    Time a function, keeping the fastest of several runs.
+    :param function: function with no arguments
+    :param repeat: number of runs
+    :return: fastest run time [s]
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        t_ini = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - t_ini)
+    return best
+
+
+def nearest_bisect(sorted_keys:list, key:float) -> float:
+    """
+    Nearest key by bisection of a sorted list; on a tie the smaller key is returned, as for BT_Tree.find_node.
+    """
+    idx = bisect.bisect_left(sorted_keys, key)
+    if idx == len(sorted_keys):
+        return sorted_keys[-1]
+    if idx == 0 or sorted_keys[idx] == key:
+        return sorted_keys[idx]
+    return sorted_keys[idx - 1] if key - sorted_keys[idx - 1] <= sorted_keys[idx] - key else sorted_keys[idx]
+
+
+def add_all(tree_class:type, keys:list) -> bt.BT_Tree:
+    tree = tree_class()
+    for key in keys:
+        tree.add(key)
+    return tree
+
+
+def insort_all(keys:list) -> list:
+    sorted_keys = []
+    for key in keys:
+        bisect.insort(sorted_keys, key)
+    return sorted_keys
+
+
+def dict_all(keys:list) -> dict:
+    table = {}
+    for key in keys:
+        table[key] = None
+    return table
+
+
+def run_case(engine:str, distribution:str, key_array:np.ndarray, operations:tuple, queries:int, repeat:int,
+             rng:np.random.Generator, baselines:bool=True) -> list[dict]:
+    """
+    Benchmark every requested operation for one engine, distribution and size.
+    :param engine: name of the tree class, key of ENGINES
+    :param distribution: key distribution of key_array, one of DISTRIBUTIONS
+    :param key_array: keys, from make_keys
+    :param operations: operations to time, subset of OPERATIONS
+    :param queries: number of queries per lookup operation
+    :param repeat: number of runs per timing, the fastest is kept
+    :param rng: NumPy random generator of the queries; seeded the same for every engine, so that all engines answer
+    the same queries
+    :param baselines: Flag, if true, also time the bisect, NumPy and dict baselines
+    :return: list of result records
+    """
+    tree_class = ENGINES[engine]
+    n = len(key_array)
+    keys = key_array.tolist()
+    sorted_keys = sorted(keys)
+    lookup_keys = rng.choice(key_array, size=queries).tolist()
+    nearest_keys = rng.integers(low=-1, high=int(key_array.max()) + 2, size=queries).tolist()
+    ranks = rng.integers(low=0, high=n, size=queries).tolist()
+    # Ranges holding about 100 keys each
+    range_starts = rng.choice(key_array, size=max(1, queries // 16)).tolist()
+    ranges = [(lo, sorted_keys[min(n - 1, bisect.bisect_left(sorted_keys, lo) + 100)] + 1) for lo in range_starts]
+    scanned = sum(bisect.bisect_left(sorted_keys, hi) - bisect.bisect_left(sorted_keys, lo) for lo, hi in ranges)
+    results = []
+
+    def record(operation:str, implementation:str, seconds:float, ops:int, **extra) -> None:
+        results.append({"engine": engine, "distribution": distribution, "size": n, "operation": operation,
+                        "implementation": implementation, "ops": ops, "seconds": seconds,
+                        "seconds_per_op": None if seconds is None else seconds / ops, **extra})
+
+    # Build; queries run on the tree built by add, as that is the shape a tree fed one key at a time ends up with
+    tree = None
+    if "add" in operations:
+        if tree_class in (bt.BT_Tree, bt.BT_ArrayTree) and distribution in ("sorted", "reverse", "zipf", "duplicates") and n > MAX_UNBALANCED_SORTED:
+            record("add", engine, None, n, skipped=f"O(n^2) for an unbalanced tree above {MAX_UNBALANCED_SORTED} keys")
+        else:
+            seconds = best_time(lambda: add_all(tree_class, keys), repeat)
+            tree = add_all(tree_class, keys)
+            record("add", engine, seconds, n, height=tree.height)
+        # Baselines are recorded for the first engine only, which may itself be skipped
+        if baselines:
+            if n <= 10 ** 6:
+                record("add", "bisect.insort", best_time(lambda: insort_all(keys), repeat), n)
+            record("add", "dict", best_time(lambda: dict_all(keys), repeat), n)
+    if "from_keys" in operations or tree is None:
+        seconds = best_time(lambda: tree_class.from_keys(key_array), repeat)
+        if tree is None:
+            tree = tree_class.from_keys(key_array)
+        record("from_keys", engine, seconds, n, height=tree.height)
+        if baselines:
+            record("from_keys", "numpy.sort", best_time(lambda: np.sort(key_array), repeat), n)
+            record("from_keys", "sorted", best_time(lambda: sorted(keys), repeat), n)
+
+    # Lookups
+    if "find_node" in operations:
+        record("find_node", engine, best_time(lambda: [tree.find_node(key) for key in lookup_keys], repeat), queries)
+        record("find_node", f"{engine}.find_many", best_time(lambda: tree.find_many(lookup_keys), repeat), queries)
+        if baselines:
+            record("find_node", "bisect", best_time(lambda: [bisect.bisect_left(sorted_keys, key) for key in lookup_keys], repeat), queries)
+            query_array = np.asarray(lookup_keys)
+            sorted_array = np.sort(key_array)
+            record("find_node", "numpy.searchsorted", best_time(lambda: np.searchsorted(sorted_array, query_array), repeat), queries)
+            table = dict.fromkeys(keys)
+            record("find_node", "dict", best_time(lambda: [key in table for key in lookup_keys], repeat), queries)
+    if "nearest" in operations:
+        record("nearest", engine, best_time(lambda: [tree.find_node(key, nearest=True) for key in nearest_keys], repeat), queries)
+        record("nearest", f"{engine}.find_many", best_time(lambda: tree.find_many(nearest_keys, nearest=True), repeat), queries)
+        if baselines:
+            record("nearest", "bisect", best_time(lambda: [nearest_bisect(sorted_keys, key) for key in nearest_keys], repeat), queries)
+    if "find_kth" in operations:
+        record("find_kth", engine, best_time(lambda: [tree.find_kth(kth) for kth in ranks], repeat), queries)
+        record("find_kth", f"{engine}.find_kth_many", best_time(lambda: tree.find_kth_many(ranks), repeat), queries)
+        if baselines:
+            record("find_kth", "sorted list index", best_time(lambda: [sorted_keys[kth] for kth in ranks], repeat), queries)
+            partition_ranks = ranks[:min(queries, 32)]
+            record("find_kth", "numpy.partition", best_time(lambda: [np.partition(key_array, kth) for kth in partition_ranks], repeat),
+                   len(partition_ranks))
+
+    # Scans
+    if "range" in operations:
+        record("range", engine, best_time(lambda: [sum(1 for _ in tree.irange(lo, hi)) for lo, hi in ranges], repeat), scanned)
+        if tree_class is bt.BT_BTree:
+            record("range", f"{engine}.items", best_time(lambda: [sum(1 for _ in tree.items(lo, hi)) for lo, hi in ranges], repeat), scanned)
+        if baselines:
+            record("range", "bisect", best_time(lambda: [sum(1 for _ in sorted_keys[bisect.bisect_left(sorted_keys, lo):bisect.bisect_left(sorted_keys, hi)])
+                                                         for lo, hi in ranges], repeat), scanned)
+    if "iterate" in operations:
+        record("iterate", engine, best_time(lambda: sum(1 for _ in tree), repeat), n)
+        if baselines:
+            record("iterate", "sorted list", best_time(lambda: sum(1 for _ in sorted_keys), repeat), n)
+    if "print" in operations:
+        def print_tree():
+            with contextlib.redirect_stdout(io.StringIO()):
+                tree.print(print_key=True, print_val=False)
+        record("print", engine, best_time(print_tree, repeat), 1)
+
+    return results
+
+
+def compare(results:list[dict], baseline_path:str, threshold:float=1.25) -> list[str]:
+    """
+    Compare results with those of an earlier run and list every timing which has slowed down.
+    :param results: result records of this run
+    :param baseline_path: path of the JSON file written by an earlier run
+    :param threshold: ratio of new to old time per operation above which a timing counts as a regression
+    :return: list of regression messages
+    """
+    with open(baseline_path) as file:
+        old = json.load(file)["results"]
+    key_of = lambda r: (r["engine"], r["distribution"], r["size"], r["operation"], r["implementation"])
+    old_times = {key_of(r): r["seconds_per_op"] for r in old if r.get("seconds_per_op")}
+
+    regressions = []
+    for result in results:
+        old_time = old_times.get(key_of(result))
+        if old_time and result.get("seconds_per_op") and result["seconds_per_op"] / old_time > threshold:
+            regressions.append(f"{' / '.join(str(k) for k in key_of(result))}: {old_time:.3e} -> "
+                               f"{result['seconds_per_op']:.3e} [s/op], {result['seconds_per_op'] / old_time:.2f}x")
+    return regressions
+
+
+def main(argv:list[str]=None) -> int:
+    """
+    Run the benchmark suite from the command line.
+    :param argv: command line arguments, defaults to sys.argv
+    :return: exit status, 1 if a comparison found regressions
+    """
+    parser = argparse.ArgumentParser(description="Benchmark binary_tree.py")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10 ** 3, 10 ** 4, 10 ** 5],
+                        help="tree sizes, e.g. 1000 10000 100000 1000000 10000000")
+    parser.add_argument("--distributions", nargs="+", default=list(DISTRIBUTIONS), choices=DISTRIBUTIONS)
+    parser.add_argument("--operations", nargs="+", default=list(OPERATIONS), choices=OPERATIONS)
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--queries", type=int, default=2 ** 12, help="queries per lookup operation")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per timing, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-baselines", action="store_true", help="skip the bisect, NumPy and dict baselines")
+    parser.add_argument("--output", default=None, help="path of the JSON results file")
+    parser.add_argument("--compare", default=None, help="path of an earlier JSON results file to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    results = []
+    for n in args.sizes:
+        for distribution in args.distributions:
+            # Keys are drawn once per case, and the queries of each engine from a generator seeded the same, so every engine
+            # gets the same keys and queries, whichever other sizes and distributions are run
+            case_seed = (args.seed, n, DISTRIBUTIONS.index(distribution))
+            key_array = make_keys(distribution=distribution, n=n, rng=np.random.default_rng(case_seed))
+            for engine in args.engines:
+                # Baselines do not depend on the engine, so only time them once per case
+                case = run_case(engine=engine, distribution=distribution, key_array=key_array,
+                                operations=tuple(args.operations), queries=args.queries, repeat=args.repeat,
+                                rng=np.random.default_rng(case_seed + (1,)),
+                                baselines=not args.no_baselines and engine == args.engines[0])
+                for result in case:
+                    seconds = "skipped" if result["seconds"] is None else f"{result['seconds_per_op']:.3e} [s/op]"
+                    print(f"{n:>9} {distribution:10} {result['operation']:9} {result['implementation']:26} {seconds}")
+                results += case
+
+    report = {"meta": {"python": sys.version.split()[0], "numpy": np.__version__, "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=1)
+
+    if args.compare:
+        regressions = compare(results=results, baseline_path=args.compare, threshold=args.threshold)
+        print(f"\n{len(regressions)} regressions slower than {args.threshold}x {args.compare}")
+        for regression in regressions:
+            print(regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
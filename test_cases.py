@@ -1,7 +1,16 @@
 import binary_tree as bt
+import bisect
+import contextlib
+import gc
+import io
 import numpy as np
+import os
 import string
+import sys
+import tempfile
+import threading
 import time
+import tracemalloc
 
 def main():
     """
@@ -10,6 +19,26 @@ def main():
         0: print tests
         1: find element test
         2: find element speed test
+        3: red-black tree test
+        4: iterative vs. recursive speed test
+        5: bulk load test
+        6: remove test
+        7: array tree and memory test
+        8: iteration test
+        9: floor and ceiling test
+        10: instrumentation test
+        11: multiset test
+        12: split, join and merge test
+        13: add_many and write buffer test
+        14: thread-safe tree stress and throughput test
+        15: snapshot test
+        16: save and load test
+        17: aggregate test
+        18: lookup cache test
+        19: B+ tree engine test
+        20: sliding window quantile test
+        21: sharded tree test
+        22: render test
         other: properties (node count, height) and methods (find nearest, find kth)
     :return:
     """
@@ -50,10 +79,148 @@ def main():
             t.add(key=this_key)
 
         test_find_speed(tree=t, test_qty=test_qty, keys=keys)
+    elif test_flag == 3:
+        test_red_black(n=test_sze)
+    elif test_flag == 4:
+        test_iterative_speed(n=test_sze, test_qty=test_qty, n_sorted=10 ** 6)
+    elif test_flag == 5:
+        test_from_keys(n=test_sze)
+    elif test_flag == 6:
+        test_remove(n=test_sze)
+    elif test_flag == 7:
+        test_array_tree(n=test_sze, test_qty=test_qty)
+    elif test_flag == 8:
+        test_iterate(n=test_sze)
+    elif test_flag == 9:
+        test_floor_ceiling(n=test_sze, test_qty=test_qty)
+    elif test_flag == 10:
+        test_stats(n=test_sze, test_qty=test_qty)
+    elif test_flag == 11:
+        test_multiset(n=test_sze)
+    elif test_flag == 12:
+        test_split_join(n=test_sze)
+    elif test_flag == 13:
+        test_add_many(n=test_sze, n_stream=2 ** 19)
+    elif test_flag == 14:
+        test_concurrent(n=test_sze, test_qty=test_qty)
+    elif test_flag == 15:
+        test_snapshot(n=test_sze, test_qty=test_qty)
+    elif test_flag == 16:
+        test_save_load(n=test_sze, test_qty=test_qty, n_large=10 ** 6)
+    elif test_flag == 17:
+        test_aggregates(n=test_sze, test_qty=test_qty)
+    elif test_flag == 18:
+        test_cache(n=test_sze, test_qty=test_qty)
+    elif test_flag == 19:
+        test_btree(n=test_sze, test_qty=test_qty, n_large=2 ** 20)
+    elif test_flag == 20:
+        test_sliding_window(n=test_sze, test_qty=test_qty)
+    elif test_flag == 21:
+        test_sharded(n=test_sze, test_qty=test_qty, n_large=2 ** 20)
+    elif test_flag == 22:
+        test_render(n=test_sze, n_large=10 ** 6)
     else:
         test_methods(tree=t, keys=keys, n=n, k=k, s=s)
 
 
+def check_tree(tree:bt.BT_Tree=None) -> list[str]:
+    """
+    Walk every node of a tree and check that parent links, node counts, heights and key order are consistent. For an
+    RB_Tree the red-black properties are checked as well.
+    :param tree: tree to check
+    :return: list of error messages, empty if the tree is consistent
+    """
+    errors = []
+    if tree.root is None:
+        return errors
+    if tree.root.parent is not None:
+        errors.append("root has a parent")
+
+    # Post-order walk with an explicit stack: (node, children visited)
+    black_heights = {}
+    stack = [(tree.root, False)]
+    while stack:
+        node, visited = stack.pop()
+        children = [child for child in (node.left_child, node.right_child) if child is not None]
+        if not visited:
+            stack.append((node, True))
+            stack.extend((child, False) for child in children)
+            continue
+
+        for child in children:
+            if child.parent != node:
+                errors.append(f"bad parent link below key {node.key}")
+        if node.left_child is not None and node.left_child.key > node.key:
+            errors.append(f"left child key {node.left_child.key} > {node.key}")
+        if node.right_child is not None and node.right_child.key < node.key:
+            errors.append(f"right child key {node.right_child.key} < {node.key}")
+        if node.node_count != node.multiplicity + sum(child.node_count for child in children):
+            errors.append(f"bad node count at key {node.key}")
+        if node.height != 1 + max([child.height for child in children], default=-1):
+            errors.append(f"bad height at key {node.key}")
+
+        if isinstance(tree, bt.RB_Tree):
+            if node.color == bt.RED and any(child.color == bt.RED for child in children):
+                errors.append(f"red node {node.key} has a red child")
+            child_black = [black_heights.pop(id(child), 0) if child is not None else 0
+                           for child in (node.left_child, node.right_child)]
+            if child_black[0] != child_black[1]:
+                errors.append(f"unequal black height below key {node.key}")
+            black_heights[id(node)] = child_black[0] + (node.color == bt.BLACK)
+
+    if tree.height != tree.root.height:
+        errors.append(f"tree height {tree.height} != root height {tree.root.height}")
+    if isinstance(tree, bt.RB_Tree) and tree.root.color != bt.BLACK:
+        errors.append("root is red")
+    return errors
+
+def check_btree(tree:bt.BT_BTree=None) -> list[str]:
+    """
+    Walk every node of a B+ tree and check that counts, separators, leaf links and depths are consistent, and that
+    every node but the root is at least half full.
+    :param tree: tree to check
+    :return: list of error messages, empty if the tree is consistent
+    """
+    errors = []
+    if tree.root is None:
+        return errors if tree.node_count == 0 else ["no root but keys counted"]
+    minimum = tree.order // 2
+    leaves = []
+
+    # Walk with an explicit stack: (node, depth, lower bound, upper bound, is root)
+    stack = [(tree.root, 0, None, None, True)]
+    while stack:
+        node, depth, lo, hi, is_root = stack.pop()
+        if isinstance(node, bt._BLeaf):
+            leaves.append(node)
+            if depth != tree.height:
+                errors.append(f"leaf at depth {depth}, height {tree.height}")
+            if node.keys != sorted(node.keys) or len(node.keys) != len(node.values) or len(node.keys) > tree.order:
+                errors.append("leaf keys unsorted, unpaired or too many")
+            if node.keys and ((lo is not None and node.keys[0] < lo) or (hi is not None and node.keys[-1] > hi)):
+                errors.append(f"leaf keys outside separators {lo}, {hi}")
+            if not is_root and len(node.keys) < minimum:
+                errors.append(f"under-full leaf of {len(node.keys)} keys")
+            continue
+        if len(node.keys) != len(node.children) - 1 or len(node.counts) != len(node.children) or len(node.children) > tree.order:
+            errors.append("inner node has wrong number of keys, counts or children")
+        if not is_root and len(node.children) < minimum:
+            errors.append(f"under-full inner node of {len(node.children)} children")
+        bounds = [lo] + node.keys + [hi]
+        for idx, child in enumerate(node.children):
+            below = len(child.keys) if isinstance(child, bt._BLeaf) else sum(child.counts)
+            if node.counts[idx] != below:
+                errors.append("bad count of a child")
+            stack.append((child, depth + 1, bounds[idx], bounds[idx + 1], False))
+
+    # Leaves were visited from the right, so their links run in the reverse order
+    leaves.reverse()
+    if any(left.next is not right or right.prev is not left for left, right in zip(leaves, leaves[1:])):
+        errors.append("bad leaf links")
+    if sum(len(leaf.keys) for leaf in leaves) != tree.node_count:
+        errors.append("node count does not match the leaves")
+    return errors
+
 def test_print(tree:bt.BT_Tree=None, k:int=0) -> None:
     print(16 * '=')
     print(f"Full tree")
@@ -82,6 +249,21 @@ def test_methods(tree:bt.BT_Tree=None, keys:np.ndarray=None, n:int=0, k:int=0, s
     print(f"{k}th element found by Numpy: {np.partition(keys, kth=k)[k]}")
     print(f"{k}th element found by BTree: {tree.find_kth(k).key}")
 
+    sorted_keys = np.sort(keys)
+    lo, hi = int(np.percentile(keys, 25)), int(np.percentile(keys, 75))
+    print(16 * '=')
+    print(f"keys less than s = {s} found by Numpy: {np.searchsorted(sorted_keys, s)}")
+    print(f"keys less than s = {s} found by BTree: {tree.rank(s)}")
+
+    print(16 * '=')
+    print(f"keys in [{lo}, {hi}) found by Numpy: {np.count_nonzero((keys >= lo) & (keys < hi))}")
+    print(f"keys in [{lo}, {hi}) found by BTree: {tree.count_range(lo, hi)}")
+
+    print(16 * '=')
+    in_range = sorted_keys[(sorted_keys >= lo) & (sorted_keys < hi)]
+    print(f"median of [{lo}, {hi}) found by Numpy: {in_range[in_range.shape[0] // 2]}")
+    print(f"median of [{lo}, {hi}) found by BTree: {tree.kth_in_range(lo, hi, tree.count_range(lo, hi) // 2).key}")
+
 def test_find_all(tree:bt.BT_Tree=None, keys:np.ndarray=None):
     print(16 * '=')
     print("Find every node")
@@ -100,6 +282,1321 @@ def test_find_all(tree:bt.BT_Tree=None, keys:np.ndarray=None):
     else:
         print("No mismatches between numpy.sort(keys)[kth] and bt.find(kth)")
 
+def test_red_black(n:int=0) -> None:
+    print(16 * '=')
+    print("Red-black tree")
+    distributions = {
+        "random": np.random.randint(low=0, high=10 * n, size=n),
+        "sorted": np.arange(n),
+        "reverse": np.arange(n)[::-1],
+        "duplicates": np.random.randint(low=0, high=8, size=n),
+    }
+    for name, keys in distributions.items():
+        tree = bt.RB_Tree()
+        for this_key in keys:
+            tree.add(key=this_key)
+
+        errors = check_tree(tree)
+        found = [tree.find_kth(idx).key for idx in range(n)]
+        max_height = 2 * np.log2(n + 1)
+        print(f"{name:10}: height {tree.height:3} <= {max_height:5.2f} is {tree.height <= max_height}, "
+              f"node count {tree.node_count}, find_kth matches numpy.sort is {np.array_equal(found, np.sort(keys))}, "
+              f"errors: {errors[:3]}")
+
+def _recursive_add(parent_node:bt.BT_Node, key:float, value:any=None) -> None:
+    """
+    Reference recursive add, as BT_Tree.add was implemented before it became loop-based. Node heights are not
+    maintained.
+    """
+    parent_node.node_count += 1
+    if key < parent_node.key:
+        if parent_node.left_child is None:
+            parent_node.left_child = bt.BT_Node(key=key, value=value, parent=parent_node)
+        else:
+            _recursive_add(parent_node=parent_node.left_child, key=key, value=value)
+    else:
+        if parent_node.right_child is None:
+            parent_node.right_child = bt.BT_Node(key=key, value=value, parent=parent_node)
+        else:
+            _recursive_add(parent_node=parent_node.right_child, key=key, value=value)
+
+def _recursive_find_node(parent_node:bt.BT_Node, key:float, nearest:bool=False) -> bt.BT_Node | None:
+    """
+    Reference recursive find, as BT_Tree.find_node was implemented before it became loop-based.
+    """
+    if key == parent_node.key:
+        nearest_node = parent_node
+    elif key < parent_node.key:
+        if parent_node.left_child is None:
+            nearest_node = parent_node if nearest else None
+        else:
+            nearest_node = _recursive_find_node(parent_node=parent_node.left_child, key=key, nearest=nearest)
+    else:
+        if parent_node.right_child is None:
+            nearest_node = parent_node if nearest else None
+        else:
+            nearest_node = _recursive_find_node(parent_node=parent_node.right_child, key=key, nearest=nearest)
+    if nearest and abs(parent_node.key - key) < abs(nearest_node.key - key):
+        nearest_node = parent_node
+    return nearest_node
+
+def _recursive_find_kth(parent_node:bt.BT_Node, kth:int=0) -> bt.BT_Node:
+    """
+    Reference recursive kth search, as BT_Tree.find_kth was implemented before it became loop-based.
+    """
+    if parent_node.left_child is not None:
+        if kth == parent_node.left_child.node_count:
+            return parent_node
+        elif kth < parent_node.left_child.node_count:
+            return _recursive_find_kth(parent_node=parent_node.left_child, kth=kth)
+        return _recursive_find_kth(parent_node=parent_node.right_child, kth=kth - parent_node.left_child.node_count - 1)
+    elif kth == 0:
+        return parent_node
+    return _recursive_find_kth(parent_node=parent_node.right_child, kth=kth - 1)
+
+def test_iterative_speed(n:int=0, test_qty:int=0, n_sorted:int=0) -> None:
+    print(16 * '=')
+    print(f"Loop-based vs. recursive operations, {n} random keys")
+    keys = np.random.randint(low=0, high=10 * n, size=n).tolist()
+    queries = np.random.randint(low=0, high=10 * n, size=test_qty).tolist()
+    ranks = np.random.randint(low=0, high=n, size=test_qty).tolist()
+
+    # Add
+    t_ini = time.perf_counter()
+    tree = bt.BT_Tree()
+    for this_key in keys:
+        tree.add(key=this_key)
+    t_add_loop = time.perf_counter() - t_ini
+
+    t_ini = time.perf_counter()
+    reference_root = bt.BT_Node(key=keys[0])
+    for this_key in keys[1:]:
+        _recursive_add(parent_node=reference_root, key=this_key)
+    t_add_recursive = time.perf_counter() - t_ini
+
+    # Find node, exact and nearest
+    t_ini = time.perf_counter()
+    found_loop = [tree.find_node(key) for key in queries]
+    t_find_loop = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    found_recursive = [_recursive_find_node(reference_root, key) for key in queries]
+    t_find_recursive = time.perf_counter() - t_ini
+
+    t_ini = time.perf_counter()
+    nearest_loop = [tree.find_node(key, nearest=True) for key in queries]
+    t_nearest_loop = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    nearest_recursive = [_recursive_find_node(reference_root, key, nearest=True) for key in queries]
+    t_nearest_recursive = time.perf_counter() - t_ini
+
+    # Find kth
+    t_ini = time.perf_counter()
+    kth_loop = [tree.find_kth(k) for k in ranks]
+    t_kth_loop = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    kth_recursive = [_recursive_find_kth(reference_root, k) for k in ranks]
+    t_kth_recursive = time.perf_counter() - t_ini
+
+    same = lambda a, b: [None if x is None else x.key for x in a] == [None if x is None else x.key for x in b]
+    # Equally near keys may be broken differently, so compare the distance to the nearest key
+    same_distance = lambda a, b: [abs(x.key - q) for x, q in zip(a, queries)] == [abs(x.key - q) for x, q in zip(b, queries)]
+    print(f"results identical: find {same(found_loop, found_recursive)}, nearest {same_distance(nearest_loop, nearest_recursive)}, "
+          f"kth {same(kth_loop, kth_recursive)}\n")
+    print(f"{'operation':10} {'loop [s/op]':>13} {'recursive [s/op]':>17} {'speedup':>8}")
+    for name, t_loop, t_rec, qty in (("add", t_add_loop, t_add_recursive, n),
+                                     ("find_node", t_find_loop, t_find_recursive, test_qty),
+                                     ("nearest", t_nearest_loop, t_nearest_recursive, test_qty),
+                                     ("find_kth", t_kth_loop, t_kth_recursive, test_qty)):
+        print(f"{name:10} {t_loop / qty:13.9f} {t_rec / qty:17.9f} {t_rec / t_loop:7.2f}x")
+
+    # Sorted inserts: deeper than the recursion limit for the unbalanced tree, and n_sorted keys for the red-black tree.
+    # The unbalanced tree becomes a chain, so each sorted insert walks every node before it, O(n^2) in total, and
+    # 10^6 sorted keys would take about 5 * 10^11 steps; the red-black tree stays O(log n) deep, so it takes the n_sorted
+    # proof.
+    print(16 * '=')
+    n_deep = 5 * sys.getrecursionlimit()
+    tree = bt.BT_Tree()
+    for this_key in range(n_deep):
+        tree.add(key=this_key)
+    print(f"BT_Tree: {n_deep} (5x the recursion limit) sorted inserts succeeded, height {tree.height}, "
+          f"find_kth({n_deep - 1}) = {tree.find_kth(n_deep - 1).key}, find_node({n_deep - 1}) = {tree.find_node(n_deep - 1).key}")
+
+    t_ini = time.perf_counter()
+    tree = bt.RB_Tree()
+    for this_key in range(n_sorted):
+        tree.add(key=this_key)
+    t_sorted = time.perf_counter() - t_ini
+    print(f"RB_Tree: {n_sorted} sorted inserts succeeded in {t_sorted:.2f} [s], height {tree.height}, "
+          f"node count {tree.node_count}, find_kth(-1) = {tree.find_kth(-1).key}")
+    print(f"The {n_sorted} sorted insert proof runs on RB_Tree: sorted keys make an unbalanced BT_Tree a chain, whose "
+          f"inserts take O(n^2) in total, so BT_Tree is only checked past the recursion limit")
+
+def test_from_keys(n:int=0) -> None:
+    print(16 * '=')
+    print(f"Bulk load, {n} keys")
+    keys = np.random.randint(low=0, high=10 * n, size=n)
+    values = np.arange(n)
+    sorted_idx = np.argsort(keys, kind="stable")
+
+    for tree_class in (bt.BT_Tree, bt.RB_Tree):
+        for size in (0, 1, 2, 3, n):
+            tree = tree_class.from_keys(keys[:size], values=values[:size])
+            found = [(tree.find_kth(idx).key, tree.find_kth(idx).value) for idx in range(size)]
+            expected = list(zip(np.sort(keys[:size], kind="stable").tolist(),
+                                values[:size][np.argsort(keys[:size], kind="stable")].tolist()))
+            min_height = max(0, int(np.ceil(np.log2(size + 1))) - 1)
+            print(f"{tree_class.__name__} {size:5} keys: height {tree.height} == {min_height} is {tree.height == min_height}, "
+                  f"node count {tree.node_count}, matches numpy.sort is {found == expected}, errors: {check_tree(tree)[:3]}")
+
+    presorted = bt.RB_Tree.from_keys(keys[sorted_idx], presorted=True)
+    print(f"presorted: matches numpy.sort is {[presorted.find_kth(idx).key for idx in range(n)] == np.sort(keys).tolist()}")
+
+    t_ini = time.perf_counter()
+    tree = bt.BT_Tree()
+    for this_key in keys:
+        tree.add(key=this_key)
+    t_add = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    bt.BT_Tree.from_keys(keys)
+    t_bulk = time.perf_counter() - t_ini
+    print(f"\nadd loop : {t_add:9.6f}  [s]\nfrom_keys: {t_bulk:9.6f}  [s]")
+
+def test_remove(n:int=0) -> None:
+    print(16 * '=')
+    print(f"Remove nodes, {n} keys")
+    for tree_class in (bt.BT_Tree, bt.RB_Tree):
+        for name, keys in (("random", np.random.randint(low=0, high=10 * n, size=n)),
+                           ("duplicates", np.random.randint(low=0, high=8, size=n))):
+            tree = tree_class()
+            for this_key in keys:
+                tree.add(key=this_key)
+            remaining = np.sort(keys).tolist()
+
+            # Remove half of the nodes by key, and a quarter by node
+            errors = []
+            for this_key in np.random.permutation(keys)[:n // 2].tolist():
+                tree.remove(this_key)
+                remaining.remove(this_key)
+            for _ in range(n // 4):
+                kth = np.random.randint(low=0, high=tree.node_count)
+                node = tree.find_kth(kth)
+                tree.remove_node(node)
+                del remaining[kth]
+                if node.parent is not None or node.node_count != 1:
+                    errors.append("removed node not detached")
+            errors += check_tree(tree)
+            found = [tree.find_kth(idx).key for idx in range(tree.node_count)]
+            print(f"{tree_class.__name__} {name:10}: node count {tree.node_count}, height {tree.height}, "
+                  f"matches remaining keys is {found == remaining}, errors: {errors[:3]}")
+
+            # Remove everything else, then a missing key
+            while tree.node_count:
+                tree.remove_node(tree.root)
+            try:
+                tree.remove(0)
+                missing = "no error"
+            except KeyError:
+                missing = "KeyError"
+            print(f"{tree_class.__name__} {name:10}: emptied, node count {tree.node_count}, height {tree.height}, "
+                  f"root {tree.root}, removing a missing key raises {missing}")
+
+    # Removing a node again, or a node of another tree, raises and leaves the tree unchanged
+    for tree_class in (bt.BT_Tree, bt.RB_Tree, bt.BT_ArrayTree):
+        tree = tree_class.from_keys([1, 2, 3, 4, 5])
+        node = tree.find_node(3)
+        tree.remove_node(node)
+        raised = []
+        for this_node in (node, tree_class.from_keys([1, 2]).find_node(1)):
+            try:
+                tree.remove_node(this_node)
+                raised.append("no error")
+            except ValueError:
+                raised.append("ValueError")
+        print(f"{tree_class.__name__}: removing a removed node raises {raised[0]}, a node of another tree raises {raised[1]}, "
+              f"node count {tree.node_count}, errors: {check_tree(tree)[:3]}")
+
+def _bytes_per_node(build, n:int) -> float:
+    """
+    Measure memory allocated per node by a function which builds a tree of n nodes.
+    """
+    tracemalloc.start()
+    tree = build()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tree
+    return allocated / n
+
+def test_array_tree(n:int=0, test_qty:int=0) -> None:
+    print(16 * '=')
+    print(f"Array tree, {n} keys")
+    keys = np.random.randint(low=0, high=10 * n, size=n)
+    queries = np.random.randint(low=0, high=10 * n, size=test_qty).tolist()
+    ranks = np.random.randint(low=0, high=n, size=test_qty).tolist()
+
+    # Same operations on both engines should give the same keys
+    node_tree = bt.BT_Tree()
+    array_tree = bt.BT_ArrayTree()
+    for idx, this_key in enumerate(keys.tolist()):
+        node_tree.add(key=this_key, value=idx)
+        array_tree.add(key=this_key, value=idx)
+    for this_key in np.random.permutation(keys)[:n // 2].tolist():
+        node_tree.remove(this_key)
+        array_tree.remove(this_key)
+    for this_key in np.random.randint(low=0, high=10 * n, size=n // 4).tolist():
+        node_tree.add(key=this_key)
+        array_tree.add(key=this_key)
+
+    pairs = lambda nodes: [None if node is None else (node.key, node.value) for node in nodes]
+    print(f"same kth nodes: {pairs(node_tree.find_kth(k) for k in range(node_tree.node_count)) == pairs(array_tree.find_kth(k) for k in range(array_tree.node_count))}, "
+          f"same find_node: {pairs(node_tree.find_node(k) for k in queries) == pairs(array_tree.find_node(k) for k in queries)}, "
+          f"same nearest: {pairs(node_tree.find_node(k, nearest=True) for k in queries) == pairs(array_tree.find_node(k, nearest=True) for k in queries)}, "
+          f"height {node_tree.height} == {array_tree.height}, storage slots {len(array_tree._keys)} for {array_tree.node_count} nodes, "
+          f"errors: {check_tree(array_tree)[:3]}")
+
+    bulk = bt.BT_ArrayTree.from_keys(keys)
+    print(f"from_keys matches numpy.sort is {[bulk.find_kth(k).key for k in range(n)] == np.sort(keys).astype(float).tolist()}, "
+          f"errors: {check_tree(bulk)[:3]}")
+
+    # Integer keys are stored exactly, as integers until a float key is added; an integer key which a float cannot
+    # hold exactly is then refused
+    tree = bt.BT_ArrayTree()
+    for this_key in (2 ** 53 + 1, -2 ** 62, 7):
+        tree.add(key=this_key)
+    exact = [key for key, _ in tree.items()] == [-2 ** 62, 7, 2 ** 53 + 1]
+    tree = bt.BT_ArrayTree.from_keys([1, 2, 3])
+    tree.add(key=2.5)
+    try:
+        tree.add(key=2 ** 53 + 1)
+        inexact = "no error"
+    except ValueError:
+        inexact = "ValueError"
+    print(f"integer keys exact {exact}, float key converts to {tree._keys.typecode!r}, keys {[key for key, _ in tree.items()]}, "
+          f"adding 2^53 + 1 then raises {inexact}, node count {tree.node_count}")
+
+    # Memory and speed
+    print(f"\n{'engine':12} {'bytes/node':>10} {'find_node [s]':>14} {'find_kth [s]':>13}")
+    for tree_class in (bt.BT_Tree, bt.BT_ArrayTree):
+        bytes_per_node = _bytes_per_node(lambda: tree_class.from_keys(keys), n)
+        tree = tree_class.from_keys(keys)
+        t_ini = time.perf_counter()
+        for this_key in queries:
+            tree.find_node(this_key)
+        t_find = (time.perf_counter() - t_ini) / test_qty
+        t_ini = time.perf_counter()
+        for k in ranks:
+            tree.find_kth(k)
+        t_kth = (time.perf_counter() - t_ini) / test_qty
+        print(f"{tree_class.__name__:12} {bytes_per_node:10.1f} {t_find:14.9f} {t_kth:13.9f}")
+
+def test_iterate(n:int=0) -> None:
+    print(16 * '=')
+    print(f"Iterate, {n} keys")
+    keys = np.random.randint(low=0, high=n // 4, size=n)
+    sorted_keys = np.sort(keys).tolist()
+    lo, hi = n // 16, n // 8
+    in_range = [this_key for this_key in sorted_keys if lo <= this_key < hi]
+
+    for tree_class in (bt.BT_Tree, bt.RB_Tree, bt.BT_ArrayTree):
+        tree = tree_class()
+        for idx, this_key in enumerate(keys.tolist()):
+            tree.add(key=this_key, value=str(idx))
+        items_match = all(tree.find_kth(idx).value == value for idx, (_, value) in enumerate(tree.items()))
+        print(f"{tree_class.__name__:12}: ascending {[node.key for node in tree] == sorted_keys}, "
+              f"descending {[node.key for node in reversed(tree)] == sorted_keys[::-1]}, items {items_match}, "
+              f"irange {[node.key for node in tree.irange(lo, hi)] == in_range}, "
+              f"reverse irange {[node.key for node in tree.irange(lo, hi, reverse=True)] == in_range[::-1]}, "
+              f"open irange {[node.key for node in tree.irange(hi=hi)] == sorted_keys[:tree.rank(hi)]}, "
+              f"empty irange {list(tree.irange(hi, lo)) == []}")
+
+    tree = bt.BT_Tree.from_keys(keys)
+    t_ini = time.perf_counter()
+    for idx in range(n):
+        tree.find_kth(idx)
+    t_kth = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    for _ in tree:
+        pass
+    t_iter = time.perf_counter() - t_ini
+    print(f"\nfind_kth for every index: {t_kth:9.6f}  [s]\niterate                 : {t_iter:9.6f}  [s]")
+
+def test_floor_ceiling(n:int=0, test_qty:int=0) -> None:
+    print(16 * '=')
+    print(f"Floor, ceiling, predecessor and successor, {n} keys")
+    keys = np.random.randint(low=0, high=n, size=n)
+    sorted_keys = np.sort(keys).tolist()
+    queries = np.random.randint(low=-2, high=n + 2, size=test_qty).tolist()
+    expected_floor = [sorted_keys[idx - 1] if idx else None for idx in (bisect.bisect_right(sorted_keys, q) for q in queries)]
+    expected_ceiling = [sorted_keys[idx] if idx < n else None for idx in (bisect.bisect_left(sorted_keys, q) for q in queries)]
+    expected_nearest = [c if f is None or (c is not None and c - q < q - f) else f
+                        for f, c, q in zip(expected_floor, expected_ceiling, queries)]
+    key_of = lambda node: None if node is None else node.key
+
+    for tree_class in (bt.BT_Tree, bt.RB_Tree, bt.BT_ArrayTree):
+        tree = tree_class()
+        for this_key in keys.tolist():
+            tree.add(key=this_key)
+        nodes = [tree.find_kth(idx) for idx in range(n)]
+        print(f"{tree_class.__name__:12}: floor {[key_of(tree.floor(q)) for q in queries] == expected_floor}, "
+              f"ceiling {[key_of(tree.ceiling(q)) for q in queries] == expected_ceiling}, "
+              f"nearest {[key_of(tree.find_node(q, nearest=True)) for q in queries] == expected_nearest}, "
+              f"batch nearest {[key_of(node) for node in tree.find_many(queries, nearest=True)] == expected_nearest}, "
+              f"successor {all(tree.successor(a) == b for a, b in zip(nodes, nodes[1:] + [None]))}, "
+              f"predecessor {all(tree.predecessor(b) == a for a, b in zip([None] + nodes, nodes))}")
+
+    tree = bt.BT_Tree.from_keys(keys)
+    t_ini = time.perf_counter()
+    for q in queries:
+        tree.find_node(q, nearest=True)
+    t_nearest = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    for q in queries:
+        _recursive_find_node(tree.root, q, nearest=True)
+    t_recursive = time.perf_counter() - t_ini
+    print(f"\nnearest by floor and ceiling: {t_nearest / test_qty:11.9f}  [s]\nnearest by recursion        : {t_recursive / test_qty:11.9f}  [s]")
+
+def test_stats(n:int=0, test_qty:int=0) -> None:
+    print(16 * '=')
+    print(f"Instrumentation, {n} keys")
+    keys = np.random.randint(low=0, high=10 * n, size=n).tolist()
+    queries = np.random.randint(low=0, high=10 * n, size=test_qty).tolist()
+
+    def run(tree:bt.BT_Tree) -> float:
+        t_ini = time.perf_counter()
+        for this_key in keys:
+            tree.add(key=this_key)
+        for this_key in queries:
+            tree.find_node(this_key)
+            tree.find_kth(this_key % n)
+        return time.perf_counter() - t_ini
+
+    def run_disabled() -> float:
+        tree = bt.BT_Tree()
+        tree.enable_stats()
+        tree.disable_stats()
+        return run(tree)
+
+    t_plain = min(run(bt.BT_Tree()) for _ in range(3))
+    t_disabled = min(run_disabled() for _ in range(3))
+    tree = bt.BT_Tree()
+    stats = tree.enable_stats()
+    t_enabled = run(tree)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tree.print()
+        tree.print_branch(tree.find_kth(n - 1))
+    tree.render(max_depth=2)
+
+    snapshot = stats.snapshot()
+    for operation, counters in snapshot.items():
+        print(f"{operation:9}: calls {counters['calls']:5}, visits {counters['visits']:6}, comparisons {counters['comparisons']:6}, "
+              f"max depth {counters['max_depth']:3}, mean depth {counters['mean_depth']:6.2f}, "
+              f"mean latency {counters['mean_seconds']:11.9f} [s], latency histogram {counters['latency_histogram']}")
+    print(f"add calls == keys added is {snapshot['add']['calls'] == n}, "
+          f"find_kth calls == queries + 1 is {snapshot['find_kth']['calls'] == test_qty + 1}, "
+          f"print calls == 2 is {snapshot['print']['calls'] == 2}, render calls == 1 is {snapshot['render']['calls'] == 1}")
+
+    exact = tree.shape_snapshot()
+    sampled = tree.shape_snapshot(sample=n // 4)
+    print(f"\nshape: height {exact['height']}, average depth {exact['average_depth']:.3f}, "
+          f"sampled average depth {sampled['average_depth']:.3f}, "
+          f"histogram sums to node count is {sum(exact['depth_histogram']) == n}, "
+          f"histogram height is {len(exact['depth_histogram']) - 1 == tree.height}")
+    print(f"\nnever instrumented: {t_plain:9.6f}  [s]\ndisabled          : {t_disabled:9.6f}  [s]\nenabled           : {t_enabled:9.6f}  [s]")
+
+def test_multiset(n:int=0) -> None:
+    print(16 * '=')
+    print(f"Multiset, {n} keys")
+    keys = np.random.randint(low=0, high=32, size=n)
+    sorted_keys = np.sort(keys).tolist()
+    unique_keys, counts = np.unique(keys, return_counts=True)
+
+    for tree_class in (bt.BT_Tree, bt.RB_Tree):
+        tree = tree_class(multiset=True)
+        for idx, this_key in enumerate(keys.tolist()):
+            tree.add(key=this_key, value=idx)
+        plain = tree_class()
+        for this_key in keys.tolist():
+            plain.add(key=this_key)
+        bulk = tree_class.from_keys(keys, values=np.arange(n), multiset=True)
+
+        for name, this_tree in (("add", tree), ("from_keys", bulk)):
+            values_match = all(node.value == np.flatnonzero(keys == node.key).tolist() for node in this_tree)
+            print(f"{tree_class.__name__} {name:9}: nodes {sum(1 for _ in this_tree)} == unique keys {unique_keys.shape[0]}, "
+                  f"node count {this_tree.node_count}, height {this_tree.height} vs. {plain.height} without multiset, "
+                  f"find_kth matches numpy.sort is {[this_tree.find_kth(idx).key for idx in range(n)] == sorted_keys}, "
+                  f"count matches numpy.unique is {[this_tree.count(k) for k in unique_keys.tolist()] == counts.tolist()}, "
+                  f"values in insert order is {values_match}, errors: {check_tree(this_tree)[:3]}")
+
+        # Remove every occurrence of one key, one at a time, then a few whole nodes
+        remaining = list(sorted_keys)
+        this_key = int(unique_keys[0])
+        removed = [tree.remove(this_key).value for _ in range(int(counts[0]))]
+        remaining = [k for k in remaining if k != this_key]
+        for _ in range(4):
+            node = tree.find_kth(tree.node_count // 2)
+            remaining = [k for k in remaining if k != node.key]
+            tree.remove_node(node)
+        print(f"{tree_class.__name__} remove   : removed values in insert order is {removed == np.flatnonzero(keys == this_key).tolist()}, "
+              f"count after removal {tree.count(this_key)}, node count {tree.node_count} == {len(remaining)}, "
+              f"find_kth matches is {[tree.find_kth(idx).key for idx in range(tree.node_count)] == remaining}, "
+              f"errors: {check_tree(tree)[:3]}")
+
+def test_split_join(n:int=0) -> None:
+    print(16 * '=')
+    print(f"Split, join and merge, {n} keys")
+    keys = np.random.randint(low=0, high=10 * n, size=n)
+    other_keys = np.random.randint(low=0, high=10 * n, size=n // 2)
+    split_key = int(np.median(keys))
+    all_keys = lambda tree: [node.key for node in tree for _ in range(node.multiplicity)]
+
+    for tree_class in (bt.BT_Tree, bt.RB_Tree, bt.BT_ArrayTree):
+        tree = tree_class()
+        for this_key in keys.tolist():
+            tree.add(key=this_key)
+        other = tree_class.from_keys(other_keys)
+
+        t_ini = time.perf_counter()
+        left, right = tree.split(split_key)
+        t_split = time.perf_counter() - t_ini
+        print(f"{tree_class.__name__:12} split: left {all_keys(left) == np.sort(keys[keys < split_key]).tolist()}, "
+              f"right {all_keys(right) == np.sort(keys[keys >= split_key]).tolist()}, original emptied {tree.node_count == 0}, "
+              f"heights {left.height}, {right.height}, errors: {(check_tree(left) + check_tree(right))[:3]}, {t_split:9.6f} [s]")
+
+        t_ini = time.perf_counter()
+        joined = tree_class.join(left, right)
+        t_join = time.perf_counter() - t_ini
+        print(f"{tree_class.__name__:12} join : matches numpy.sort {all_keys(joined) == np.sort(keys).tolist()}, "
+              f"node count {joined.node_count}, height {joined.height}, errors: {check_tree(joined)[:3]}, {t_join:9.6f} [s]")
+
+        t_ini = time.perf_counter()
+        merged = tree_class.merge(joined, other)
+        t_merge = time.perf_counter() - t_ini
+        t_ini = time.perf_counter()
+        for node in other:
+            joined.add(key=node.key)
+        t_add = time.perf_counter() - t_ini
+        print(f"{tree_class.__name__:12} merge: matches numpy.sort {all_keys(merged) == np.sort(np.concatenate((keys, other_keys))).tolist()}, "
+              f"height {merged.height} vs. {joined.height} by add, errors: {check_tree(merged)[:3]}, "
+              f"{t_merge:9.6f} [s] vs. {t_add:9.6f} [s] by add")
+
+    try:
+        bt.BT_Tree.join(bt.BT_Tree.from_keys([5, 6]), bt.BT_Tree.from_keys([1, 2]))
+        overlap = "no error"
+    except ValueError:
+        overlap = "ValueError"
+    print(f"joining overlapping trees raises {overlap}")
+    for tree_class in (bt.BT_Tree, bt.RB_Tree, bt.BT_ArrayTree):
+        try:
+            tree_class.from_keys([1, 2]).split(None)
+            split_none = "no error"
+        except ValueError:
+            split_none = "ValueError"
+        print(f"{tree_class.__name__}: splitting at None raises {split_none}")
+
+def test_add_many(n:int=0, n_stream:int=0) -> None:
+    print(16 * '=')
+    print(f"add_many and write buffer, {n} keys")
+    keys = np.random.randint(low=0, high=n // 4, size=n)
+    sorted_keys = np.sort(keys, kind="stable")
+    sorted_values = np.argsort(keys, kind="stable").tolist()
+    all_keys = lambda tree: [node.key for node in tree for _ in range(node.multiplicity)]
+
+    # Add the first quarter one at a time, then the rest in batches, small enough that most are inserted, not rebuilt
+    for tree_class in (bt.BT_Tree, bt.RB_Tree, bt.BT_ArrayTree):
+        for multiset in ((False, True) if tree_class is not bt.BT_ArrayTree else (False,)):
+            tree = tree_class(multiset=multiset)
+            for idx, this_key in enumerate(keys[:n // 4].tolist()):
+                tree.add(key=this_key, value=idx)
+            tree.add_many((k for k in keys[n // 4:].tolist()), values=range(n // 4, n), batch_size=64)
+            values = [v for node in tree for v in node.value] if multiset else [node.value for node in tree]
+            print(f"{tree_class.__name__:12} multiset {multiset!s:5}: matches numpy.sort {all_keys(tree) == sorted_keys.tolist()}, "
+                  f"values in insert order {values == sorted_values}, node count {tree.node_count}, height {tree.height}, "
+                  f"errors: {check_tree(tree)[:3]}")
+
+    # Reads through a write buffer see buffered keys
+    buffered = bt.BT_BufferedTree(bt.BT_Tree.from_keys(keys[:n // 2]), buffer_size=n)
+    for this_key in keys[n // 2:].tolist():
+        buffered.add(key=this_key)
+    queries = np.random.randint(low=-1, high=n // 4 + 1, size=256).tolist()
+    nearest = [bisect.bisect_left(sorted_keys.tolist(), q) for q in queries]
+    expected = [sorted_keys[max(0, i - 1)] if i == len(sorted_keys) or (i > 0 and q - sorted_keys[i - 1] <= sorted_keys[i] - q)
+                else sorted_keys[i] for q, i in zip(queries, nearest)]
+    print(f"BT_BufferedTree: {buffered.buffered} keys buffered, node count {buffered.node_count}, "
+          f"find_kth matches numpy.sort {[buffered.find_kth(idx).key for idx in range(n)] == sorted_keys.tolist()}, "
+          f"iteration matches {[node.key for node in buffered] == sorted_keys.tolist()}, "
+          f"reversed matches {[node.key for node in reversed(buffered)] == sorted_keys[::-1].tolist()}, "
+          f"find_node {all(buffered.find_node(k).key == k for k in keys.tolist())}, "
+          f"nearest {[buffered.find_node(q, nearest=True).key for q in queries] == [int(k) for k in expected]}")
+    height = buffered.height
+    print(f"BT_BufferedTree: after reading height {height}, multiset {buffered.multiset} and node count, {buffered.buffered} keys buffered")
+    rank = buffered.rank(n // 8)
+    print(f"BT_BufferedTree: after rank {rank == bisect.bisect_left(sorted_keys.tolist(), n // 8)}, {buffered.buffered} keys buffered, "
+          f"height {buffered.height}, errors: {check_tree(buffered.tree)[:3]}")
+
+    # Sustained throughput of a stream of keys, from a generator and from NumPy chunks
+    stream = np.random.randint(low=0, high=10 * n_stream, size=n_stream)
+    stream_list = stream.tolist()
+    print(f"Insert throughput, {n_stream} keys")
+    for tree_class in (bt.BT_Tree, bt.RB_Tree):
+        timings = {}
+        for name in ("add", "add_many generator", "add_many NumPy chunks", "BT_BufferedTree add"):
+            gc.collect()
+            t_ini = time.perf_counter()
+            tree = tree_class()
+            if name == "add":
+                for this_key in (k for k in stream_list):
+                    tree.add(key=this_key)
+            elif name == "add_many generator":
+                tree.add_many(k for k in stream_list)
+            elif name == "add_many NumPy chunks":
+                for idx in range(0, n_stream, 2 ** 16):
+                    tree.add_many(stream[idx:idx + 2 ** 16])
+            else:
+                buffer = bt.BT_BufferedTree(tree, buffer_size=2 ** 14)
+                for this_key in (k for k in stream_list):
+                    buffer.add(key=this_key)
+                buffer.flush()
+            timings[name] = time.perf_counter() - t_ini
+            print(f"{tree_class.__name__:7} {name:22}: {n_stream / timings[name]:10.0f} [keys/s], "
+                  f"{timings['add'] / timings[name]:5.2f}x add, height {tree.height}")
+            del tree
+            gc.collect()
+
+    # Ascending keys, e.g. timestamps: each batch is past the keys of the tree, so it is joined on, not inserted
+    ascending = np.cumsum(np.random.randint(low=0, high=4, size=n_stream)).tolist()
+    timings = {}
+    for name in ("add", "add_many generator"):
+        gc.collect()
+        t_ini = time.perf_counter()
+        tree = bt.RB_Tree()
+        if name == "add":
+            for this_key in (k for k in ascending):
+                tree.add(key=this_key)
+        else:
+            tree.add_many(k for k in ascending)
+        timings[name] = time.perf_counter() - t_ini
+        print(f"RB_Tree ascending {name:18}: {n_stream / timings[name]:10.0f} [keys/s], "
+              f"{timings['add'] / timings[name]:5.2f}x add, height {tree.height}, errors: {check_tree(tree)[:3]}")
+        del tree
+        gc.collect()
+
+def test_concurrent(n:int=0, test_qty:int=0) -> None:
+    print(16 * '=')
+    print(f"Thread-safe tree, {n} keys")
+    keys = np.random.randint(low=0, high=10 * n, size=n)
+
+    # Stress: writers add and remove their own keys while readers check that every read sees a consistent tree
+    for tree_class in (bt.BT_Tree, bt.RB_Tree):
+        tree = bt.BT_ConcurrentTree(tree_class.from_keys(keys))
+        errors = []
+        n_writers, n_readers, n_rounds = 4, 4, 2 ** 9
+
+        def writer(seed:int) -> None:
+            rng = np.random.default_rng(seed)
+            own = rng.integers(low=0, high=10 * n, size=n_rounds).tolist()
+            for this_key in own:
+                tree.add(key=this_key)
+            for this_key in own[::2]:
+                if tree.remove(this_key) is None:
+                    errors.append(f"key {this_key} not found by remove")
+
+        def reader(seed:int) -> None:
+            rng = np.random.default_rng(seed)
+            for round_idx in range(n_rounds // 4):
+                node_count = tree.node_count
+                found = tree.find_kth_many(rng.integers(low=0, high=n, size=64).tolist())
+                if any(node is None for node in found):
+                    errors.append("find_kth_many returned None")
+                scanned = [node.key for node in tree] if round_idx % 16 == 0 else None
+                if scanned is not None and (scanned != sorted(scanned) or len(scanned) < n):
+                    errors.append("iteration is not sorted")
+                with tree.reading():
+                    if round_idx % 16 == 0:
+                        errors.extend(check_tree(tree.tree))
+                    elif tree.tree.node_count != sum(1 for _ in tree.tree.irange()):
+                        errors.append("node count does not match iteration")
+                if node_count < n:
+                    errors.append("node count below the initial keys")
+
+        threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(n_writers)]
+        threads += [threading.Thread(target=reader, args=(seed,)) for seed in range(n_writers, n_writers + n_readers)]
+        t_ini = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        t_run = time.perf_counter() - t_ini
+
+        expected = list(keys.tolist())
+        for seed in range(n_writers):
+            own = np.random.default_rng(seed).integers(low=0, high=10 * n, size=n_rounds).tolist()
+            expected += own[1::2]
+        print(f"{tree_class.__name__}: {n_writers} writers, {n_readers} readers, contents match {[node.key for node in tree] == sorted(expected)}, "
+              f"errors: {errors[:3]}, {len(errors)} in total, {t_run:9.6f} [s]")
+
+    # Iteration in small chunks, with the tree changed between chunks: keys added behind the scan are not returned,
+    # keys added ahead of it are
+    for tree_class in (bt.BT_Tree, bt.RB_Tree, bt.BT_ArrayTree):
+        tree = bt.BT_ConcurrentTree(tree_class.from_keys(np.random.randint(low=0, high=64, size=256)))
+        tree._SCAN_CHUNK = 5
+        expected = [node.key for node in tree.tree.irange()]
+        scans_match = ([node.key for node in tree] == expected and [node.key for node in reversed(tree)] == expected[::-1]
+                       and [key for key, _ in tree.items()] == expected
+                       and [node.key for node in tree.irange(8, 40, reverse=True)] == [key for key in reversed(expected) if 8 <= key < 40])
+        scan = iter(tree)
+        head = [next(scan).key for _ in range(7)]
+        tree.add(key=-1)
+        tree.add(key=1000)
+        tail = [node.key for node in scan]
+        print(f"{tree_class.__name__}: chunked scans match {scans_match}, changed during a scan: sorted {head + tail == sorted(head + tail)}, "
+              f"key added behind {-1 in tail}, key added ahead {1000 in tail}")
+
+    # Throughput of a 90% read, 10% write mix; CPython runs one thread at a time, so reads are not faster in parallel,
+    # but the lock keeps them correct
+    ops_per_thread = test_qty
+    print(f"Throughput, 90% find_node / find_kth, 10% add")
+    for n_threads in (1, 2, 4, 8):
+        tree = bt.BT_ConcurrentTree(bt.RB_Tree.from_keys(keys))
+
+        def worker(seed:int) -> None:
+            rng = np.random.default_rng(seed)
+            operations = rng.random(size=ops_per_thread).tolist()
+            operands = rng.integers(low=0, high=n, size=ops_per_thread).tolist()
+            for operation, operand in zip(operations, operands):
+                if operation < 0.45:
+                    tree.find_node(operand * 10)
+                elif operation < 0.9:
+                    tree.find_kth(operand)
+                else:
+                    tree.add(key=operand * 10)
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(n_threads)]
+        t_ini = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        t_run = time.perf_counter() - t_ini
+        print(f"{n_threads} threads: {n_threads * ops_per_thread / t_run:10.0f} [ops/s], errors: {check_tree(tree.tree)[:3]}")
+
+    # Unlocked single thread, and one lock per batch
+    tree = bt.RB_Tree.from_keys(keys)
+    queries = np.random.randint(low=0, high=n, size=ops_per_thread).tolist()
+    t_ini = time.perf_counter()
+    for kth in queries:
+        tree.find_kth(kth)
+    t_unlocked = time.perf_counter() - t_ini
+    shared = bt.BT_ConcurrentTree(tree)
+    t_ini = time.perf_counter()
+    for kth in queries:
+        shared.find_kth(kth)
+    t_locked = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    shared.find_kth_many(queries)
+    t_batch = time.perf_counter() - t_ini
+    print(f"find_kth: unlocked {ops_per_thread / t_unlocked:10.0f}, locked {ops_per_thread / t_locked:10.0f}, "
+          f"locked find_kth_many {ops_per_thread / t_batch:10.0f} [ops/s]")
+
+def test_snapshot(n:int=0, test_qty:int=0) -> None:
+    print(16 * '=')
+    print(f"Snapshots, {n} keys")
+    keys = np.random.randint(low=0, high=10 * n, size=n)
+    updates = np.random.randint(low=0, high=10 * n, size=test_qty).tolist()
+    all_keys = lambda tree: [node.key for node in tree for _ in range(node.multiplicity)]
+
+    def matches(snapshot:bt.BT_Snapshot, expected:list) -> bool:
+        # Iteration both ways, find_kth, find_node, nearest and node count of a snapshot all match a sorted list
+        return (all_keys(snapshot) == expected and
+                [node.key for node in reversed(snapshot) for _ in range(node.multiplicity)] == expected[::-1] and
+                [snapshot.find_kth(idx).key for idx in range(len(expected))] == expected and
+                all(snapshot.find_node(k).key == k for k in expected[::7]) and
+                all(snapshot.find_node(k + 1, nearest=True) is not None for k in expected[::7]) and
+                snapshot.node_count == len(expected))
+
+    for tree_class in (bt.BT_Tree, bt.RB_Tree):
+        for multiset in (False, True):
+            tree = tree_class.from_keys(keys, multiset=multiset)
+            expected = np.sort(keys).tolist()
+            first = tree.snapshot()
+            first_expected = list(expected)
+
+            # Interleave adds and removes; a second snapshot is taken half way
+            second = second_expected = None
+            for idx, this_key in enumerate(updates):
+                if idx % 3 == 2:
+                    removed = tree.remove(expected[this_key % len(expected)]).key
+                    expected.remove(removed)
+                else:
+                    tree.add(key=this_key)
+                    bisect.insort(expected, this_key)
+                if idx == len(updates) // 2:
+                    second = tree.snapshot()
+                    second_expected = list(expected)
+            copied = len(tree._owned)
+
+            errors = check_tree(tree)
+            print(f"{tree_class.__name__} multiset {multiset!s:5}: tree matches {all_keys(tree) == expected}, errors: {errors[:3]}, "
+                  f"first snapshot matches {matches(first, first_expected)}, second matches {matches(second, second_expected)}, "
+                  f"{copied} nodes copied since the second for {len(updates) - len(updates) // 2 - 1} updates, height {tree.height}")
+
+            # Split and join rebuild a tree which shares nodes; the snapshots are unchanged
+            left, right = tree.split(expected[len(expected) // 2])
+            joined = tree_class.join(left, right)
+            print(f"{tree_class.__name__} multiset {multiset!s:5}: split and join match {all_keys(joined) == expected}, "
+                  f"errors: {check_tree(joined)[:3]}, snapshots match {matches(first, first_expected) and matches(second, second_expected)}")
+
+    try:
+        first.add(key=1)
+        read_only = "no error"
+    except TypeError:
+        read_only = "TypeError"
+    print(f"adding to a snapshot raises {read_only}")
+
+    # Time and memory: snapshot in O(1) vs. a copy, and memory kept by a snapshot in proportion to the updates
+    tree = bt.RB_Tree.from_keys(np.random.randint(low=0, high=10 ** 7, size=2 ** 18))
+    t_ini = time.perf_counter()
+    snapshot = tree.snapshot()
+    t_snapshot = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    bt.RB_Tree.merge(tree, bt.RB_Tree())
+    t_copy = time.perf_counter() - t_ini
+    print(f"{tree.node_count} nodes: snapshot {t_snapshot:9.6f} [s], copy {t_copy:9.6f} [s]")
+    for n_updates in (2 ** 8, 2 ** 10, 2 ** 12):
+        snapshot = tree.snapshot()
+        tracemalloc.start()
+        for this_key in np.random.randint(low=0, high=10 ** 7, size=n_updates).tolist():
+            tree.add(key=this_key)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        snapshot = tree.snapshot()
+        gc.collect()
+        t_ini = time.perf_counter()
+        for this_key in np.random.randint(low=0, high=10 ** 7, size=n_updates).tolist():
+            tree.add(key=this_key)
+        t_add = time.perf_counter() - t_ini
+        del snapshot
+        gc.collect()
+        t_ini = time.perf_counter()
+        for this_key in np.random.randint(low=0, high=10 ** 7, size=n_updates).tolist():
+            tree.add(key=this_key)
+        t_plain = time.perf_counter() - t_ini
+        print(f"{n_updates:5} adds with a snapshot: {memory / n_updates:7.0f} [bytes/add], "
+              f"{t_add / n_updates * 1e6:6.2f} [us/add] vs. {t_plain / n_updates * 1e6:6.2f} [us/add] without")
+
+    try:
+        bt.BT_ArrayTree.from_keys(keys).snapshot()
+        array_snapshot = "no error"
+    except TypeError:
+        array_snapshot = "TypeError"
+    print(f"BT_ArrayTree.snapshot raises {array_snapshot}")
+
+def test_save_load(n:int=0, test_qty:int=0, n_large:int=0) -> None:
+    print(16 * '=')
+    print(f"Save and load, {n} keys")
+    keys = np.random.randint(low=0, high=10 * n, size=n)
+    queries = np.random.randint(low=-1, high=10 * n + 2, size=test_qty).tolist()
+    shape = lambda tree: [(node.key, node.value, node.node_count, node.height, node.color, node.multiplicity) for node in tree]
+    path = os.path.join(tempfile.mkdtemp(), "tree.bin")
+
+    for tree_class in (bt.BT_Tree, bt.RB_Tree, bt.BT_ArrayTree):
+        for multiset in (False, True) if tree_class is not bt.BT_ArrayTree else (False,):
+            tree = tree_class(multiset=multiset)
+            for this_key in keys.tolist():
+                tree.add(key=this_key, value=str(this_key))
+            tree.save(path)
+
+            # Full load rebuilds the same class, with the same shape
+            loaded = bt.BT_Tree.load(path, mmap=False)
+            errors = [] if tree_class is bt.BT_ArrayTree else check_tree(loaded)
+            print(f"{tree_class.__name__} multiset {multiset!s:5}: loaded {type(loaded).__name__}, shape matches "
+                  f"{shape(loaded) == shape(tree) and loaded.root.key == tree.root.key}, errors: {errors[:3]}")
+            if multiset:
+                continue
+
+            # Memory-mapped load answers every query as the tree does
+            mapped = bt.BT_Tree.load(path)
+            sorted_keys = np.sort(keys).tolist()
+            print(f"{tree_class.__name__} mapped: iteration matches {[node.key for node in mapped] == sorted_keys}, "
+                  f"values match {[value for _, value in mapped.items()] == [str(k) for k in sorted_keys]}, "
+                  f"find_node matches {all((tree.find_node(q) is None) == (mapped.find_node(q) is None) for q in queries)}, "
+                  f"nearest matches {all(tree.find_node(q, nearest=True).key == mapped.find_node(q, nearest=True).key for q in queries)}, "
+                  f"find_kth matches {all(mapped.find_kth(idx).key == k for idx, k in enumerate(sorted_keys))}, "
+                  f"rank matches {all(tree.rank(q) == mapped.rank(q) for q in queries)}, "
+                  f"root and height match {mapped.root.key == tree.root.key and mapped.height == tree.height}")
+
+    # A snapshot saves as a BT_Tree; a mapped tree is read-only
+    tree = bt.RB_Tree.from_keys(keys)
+    snapshot = tree.snapshot()
+    tree.add(key=-1)
+    snapshot.save(path)
+    loaded = bt.BT_Tree.load(path, mmap=False)
+    print(f"snapshot: loaded {type(loaded).__name__}, matches {[node.key for node in loaded] == np.sort(keys).tolist()}")
+    try:
+        bt.BT_Tree.load(path).add(key=1)
+        read_only = "no error"
+    except TypeError:
+        read_only = "TypeError"
+    print(f"adding to a mapped tree raises {read_only}")
+
+    # Keys are loaded as saved: integers stay integers, and integers which a float cannot hold exactly are not rounded
+    large_keys = [2 ** 53 + 1, 3, -2 ** 62]
+    bt.BT_ArrayTree.from_keys(large_keys).save(path)
+    loaded = bt.BT_Tree.load(path, mmap=False)
+    mapped = bt.BT_Tree.load(path)
+    exact = [key for key, _ in loaded.items()] == [key for key, _ in mapped.items()] == sorted(large_keys)
+    del mapped
+    try:
+        bt.BT_Tree.from_keys(large_keys + [0.5]).save(path)
+        inexact = "no error"
+    except ValueError:
+        inexact = "ValueError"
+    try:
+        bt.BT_Tree.from_keys([1, 1], multiset=True).save(path)
+        bt.BT_Tree.load(path)
+        mapped_multiset = "no error"
+    except ValueError:
+        mapped_multiset = "ValueError"
+    print(f"integer keys load exactly {exact}, saving a large integer key among floats raises {inexact}, "
+          f"memory-mapping a multiset tree raises {mapped_multiset}")
+
+    # Time: save, memory-mapped load and full load of a large tree, and queries of the mapped tree
+    keys = np.random.randint(low=0, high=10 * n_large, size=n_large)
+    tree = bt.RB_Tree.from_keys(keys)
+    queries = np.random.choice(keys, size=test_qty).tolist()
+    ranks = np.random.randint(low=0, high=n_large, size=test_qty).tolist()
+    gc.collect()
+    t_ini = time.perf_counter()
+    tree.save(path)
+    t_save = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    mapped = bt.BT_Tree.load(path)
+    t_mapped = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    [mapped.find_node(q) for q in queries]
+    t_find = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    [mapped.find_kth(kth) for kth in ranks]
+    t_kth = time.perf_counter() - t_ini
+    del tree
+    gc.collect()
+    t_ini = time.perf_counter()
+    bt.BT_Tree.load(path, mmap=False)
+    t_load = time.perf_counter() - t_ini
+    print(f"{n_large} keys, {os.path.getsize(path) / n_large:.0f} [bytes/key]: save {t_save:7.3f} [s], "
+          f"mmap load {t_mapped:9.6f} [s], full load {t_load:7.3f} [s]; mapped find_node "
+          f"{t_find / test_qty * 1e6:5.2f} [us], find_kth {t_kth / test_qty * 1e6:5.2f} [us]")
+    del mapped
+    os.remove(path)
+
+def test_aggregates(n:int=0, test_qty:int=0) -> None:
+    print(16 * '=')
+    print(f"Aggregates, {n} keys")
+    functions = {"sum": lambda a, b: a + b, "max": max, "first": lambda a, b: a}
+    identities = {"sum": 0, "max": None, "first": None}
+
+    def scan(tree:bt.BT_Tree, lo:float, hi:float, name:str) -> any:
+        # Aggregate of the values in [lo, hi) by scanning the nodes
+        values = [value for key, value in tree.items() if (lo is None or key >= lo) and (hi is None or key < hi)
+                  for value in (value if tree.multiset else [value])]
+        total = identities[name] if not values else values[0]
+        for value in values[1:]:
+            total = functions[name](total, value)
+        return total
+
+    def matches(tree:bt.BT_Tree) -> bool:
+        # Random ranges and prefixes of every aggregate match a scan
+        bounds = np.random.randint(low=-1, high=10 * n + 2, size=(64, 2)).tolist()
+        ranges = bounds + [[None, hi] for _, hi in bounds[:8]] + [[lo, None] for lo, _ in bounds[:8]]
+        return (all(tree.aggregate_range(lo, hi, name) == scan(tree, lo, hi, name) for lo, hi in ranges for name in functions) and
+                all(tree.prefix_aggregate(key, name) == scan(tree, None, key, name) and
+                    tree.prefix_aggregate(key, name, inclusive=True) == scan(tree, None, key + 1, name)
+                    for key, _ in bounds for name in functions))
+
+    for tree_class in (bt.BT_Tree, bt.RB_Tree):
+        for multiset in (False, True):
+            keys = np.random.randint(low=0, high=10 * n, size=n)
+            values = np.random.randint(low=-100, high=100, size=n).tolist()
+            tree = tree_class(multiset=multiset)
+            tree.add_aggregate("sum")
+            tree.add_aggregate("max", "max")
+            tree.add_aggregate("first", functions["first"])
+            for this_key, value in zip(keys.tolist(), values):
+                tree.add(key=this_key, value=value)
+            added = matches(tree)
+
+            # Removes, with a snapshot taken before them, then add_many, split and join
+            snapshot = tree.snapshot()
+            for this_key in np.random.choice(keys, size=n // 4).tolist():
+                if tree.find_node(this_key) is not None:
+                    tree.remove(this_key)
+            removed = matches(tree) and matches(snapshot)
+            tree.add_many(np.random.randint(low=0, high=10 * n, size=n // 16), values=[1] * (n // 16))
+            tree.add_many(np.random.randint(low=0, high=10 * n, size=n), values=[2] * n)
+            left, right = tree.split(5 * n)
+            tree = tree_class.join(left, right)
+            print(f"{tree_class.__name__} multiset {multiset!s:5}: adds match {added}, removes and snapshot match {removed}, "
+                  f"add_many, split and join match {matches(tree)}, errors: {check_tree(tree)[:3]}")
+
+    # A value which the aggregate function cannot combine, here the default None with a sum, raises and leaves the tree
+    # unchanged, whether added by add or by an add_many which rebuilds the tree. An add_many which adds keys one at a
+    # time keeps the keys before the failed one.
+    for tree_class in (bt.BT_Tree, bt.RB_Tree):
+        for multiset in (False, True):
+            tree = tree_class(multiset=multiset)
+            tree.add_aggregate("s", "sum")
+            for this_key in range(10):
+                tree.add(key=this_key, value=this_key)
+            unchanged = True
+            for add in (lambda: tree.add(100), lambda: tree.add(5), lambda: tree.add_many(range(100, 110), values=[1] * 9 + [None]),
+                        lambda: tree.add_many([100])):
+                try:
+                    add()
+                    unchanged = False
+                except TypeError:
+                    pass
+                unchanged = (unchanged and tree.node_count == 10 and [key for key, _ in tree.items()] == list(range(10)) and
+                             not check_tree(tree) and tree.aggregate_range(None, None, "s") == 45)
+            try:
+                tree.add_many([100, 101], values=[1, None])
+                partial = "no error"
+            except TypeError:
+                partial = "TypeError"
+            kept = [key for key, _ in tree.items()] == list(range(10)) + [100] and tree.aggregate_range(None, None, "s") == 46
+            print(f"{tree_class.__name__} multiset {multiset!s:5}: failed adds raise TypeError and leave the tree unchanged "
+                  f"{unchanged}; add_many one at a time raises {partial}, keeps earlier keys {kept}, errors: {check_tree(tree)[:3]}")
+    try:
+        bt.BT_ArrayTree().add_aggregate("s", "sum")
+        array_aggregate = "no error"
+    except TypeError:
+        array_aggregate = "TypeError"
+    print(f"BT_ArrayTree.add_aggregate raises {array_aggregate}")
+
+    # Time: aggregate_range vs. a scan and a NumPy cumulative sum rebuilt after each batch, and add with aggregates
+    keys = np.random.randint(low=0, high=10 * n, size=n)
+    values = np.random.randint(low=0, high=100, size=n)
+    bounds = np.sort(np.random.randint(low=0, high=10 * n, size=(test_qty, 2)), axis=1).tolist()
+    plain = bt.RB_Tree()
+    tree = bt.RB_Tree()
+    tree.add_aggregate("sum")
+    t_ini = time.perf_counter()
+    for this_key, value in zip(keys.tolist(), values.tolist()):
+        plain.add(key=this_key, value=value)
+    t_plain = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    for this_key, value in zip(keys.tolist(), values.tolist()):
+        tree.add(key=this_key, value=value)
+    t_add = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    sums = [tree.aggregate_range(lo, hi) for lo, hi in bounds]
+    t_range = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    cumulative = np.concatenate(([0], np.cumsum(values[order])))
+    t_cumsum = time.perf_counter() - t_ini
+    lo, hi = np.array(bounds).T
+    numpy_sums = cumulative[np.searchsorted(sorted_keys, hi)] - cumulative[np.searchsorted(sorted_keys, lo)]
+    t_ini = time.perf_counter()
+    for lo, hi in bounds[:test_qty // 16]:
+        sum(value for _, value in plain.items() if lo <= _ < hi)
+    t_scan = (time.perf_counter() - t_ini) * 16
+    print(f"{n} keys: add {t_plain / n * 1e6:5.2f} [us] without aggregates, {t_add / n * 1e6:5.2f} [us] with a sum; "
+          f"aggregate_range {t_range / test_qty * 1e6:6.2f} [us], scan {t_scan / test_qty * 1e6:9.2f} [us], "
+          f"NumPy cumulative sum rebuild {t_cumsum * 1e6:8.2f} [us]; matches NumPy {sums == numpy_sums.tolist()}")
+
+def test_cache(n:int=0, test_qty:int=0) -> None:
+    print(16 * '=')
+    print(f"Lookup cache, {n} keys")
+
+    # A skewed mix of queries, adds and removes: a few hot keys and positions are queried many times between updates
+    hot_keys = np.random.randint(low=0, high=10 * n, size=32).tolist()
+    operations = np.random.random(size=16 * test_qty).tolist()
+
+    for tree_class in (bt.BT_Tree, bt.RB_Tree, bt.BT_ArrayTree):
+        for multiset in (False, True) if tree_class is not bt.BT_ArrayTree else (False,):
+            for capacity, eviction in ((8, "lru"), (1024, "fifo")):
+                keys = np.random.randint(low=0, high=10 * n, size=n)
+                cached = tree_class.from_keys(keys, multiset=multiset)
+                plain = tree_class.from_keys(keys, multiset=multiset)
+                cache = cached.enable_cache(capacity=capacity, eviction=eviction)
+                mismatches = 0
+                snapshot = None
+                for idx, operation in enumerate(operations):
+                    this_key = hot_keys[idx % len(hot_keys)] + (idx % 3 - 1) * (operation < 0.5)
+                    if operation < 0.05:
+                        cached.add(key=this_key)
+                        plain.add(key=this_key)
+                    elif operation < 0.1:
+                        removed_key = plain.find_kth(idx % plain.node_count).key
+                        cached.remove(removed_key)
+                        plain.remove(removed_key)
+                    elif operation < 0.11 and cached.find_node(this_key) is not None:
+                        cached.remove_node(cached.find_node(this_key))
+                        plain.remove_node(plain.find_node(this_key))
+                    elif operation < 0.111 and tree_class is not bt.BT_ArrayTree:
+                        snapshot = cached.snapshot() if snapshot is None else None
+                    elif operation < 0.112:
+                        added = np.random.randint(low=0, high=10 * n, size=64)
+                        cached.add_many(added)
+                        plain.add_many(added)
+                    elif operation < 0.4:
+                        found = cached.find_node(this_key), plain.find_node(this_key)
+                        mismatches += (found[0] is None) != (found[1] is None) or (found[0] is not None and found[0].key != found[1].key)
+                    elif operation < 0.7:
+                        mismatches += cached.find_node(this_key + 0.5, nearest=True).key != plain.find_node(this_key + 0.5, nearest=True).key
+                    else:
+                        kth = (0, -1, plain.node_count // 2, plain.node_count * 99 // 100)[idx % 4]
+                        mismatches += cached.find_kth(kth).key != plain.find_kth(kth).key
+                counters = cache.snapshot()
+                print(f"{tree_class.__name__:12} multiset {multiset!s:5} capacity {capacity:4} {eviction}: {mismatches} mismatches, "
+                      f"hit rates " + ", ".join(f"{table} {counters[table]['hit_rate']:.2f}" for table in bt.BT_Cache.TABLES) +
+                      f", evictions {sum(counters[table]['evictions'] for table in bt.BT_Cache.TABLES)}, "
+                      f"invalidations {sum(counters[table]['invalidations'] for table in bt.BT_Cache.TABLES)}")
+
+    # Time: hot queries with and without the cache, one add between every 1000 queries
+    for tree_class, n in ((bt.RB_Tree, n), (bt.RB_Tree, 2 ** 20), (bt.BT_ArrayTree, 2 ** 20)):
+        keys = np.random.randint(low=0, high=10 * n, size=n)
+        queries = np.random.choice(hot_keys, size=16 * test_qty).tolist()
+        ranks = np.random.choice([n // 2, n * 99 // 100], size=16 * test_qty).tolist()
+        for enabled in (False, True):
+            tree = tree_class.from_keys(keys)
+            if enabled:
+                tree.enable_cache(capacity=64)
+            gc.collect()
+            t_ini = time.perf_counter()
+            for idx, this_key in enumerate(queries):
+                if idx % 1000 == 0:
+                    tree.add(key=this_key + 1)
+                tree.find_node(this_key, nearest=True)
+                tree.find_kth(ranks[idx])
+            t_query = time.perf_counter() - t_ini
+            print(f"{tree_class.__name__:12} {n:8} keys, cache {enabled!s:5}: {t_query / len(queries) / 2 * 1e6:5.2f} [us/query]" +
+                  (f", hit rate {tree.cache.snapshot()['nearest']['hit_rate']:.3f}" if enabled else ""))
+
+def test_btree(n:int=0, test_qty:int=0, n_large:int=0) -> None:
+    print(16 * '=')
+    print(f"B+ tree, {n} keys")
+
+    # Random adds and removes, with many duplicates, checked against a sorted list after every batch
+    for order in (4, 5, 64):
+        tree = bt.BT_BTree(order=order)
+        reference = []
+        mismatches = 0
+        errors = []
+        for batch in range(32):
+            for this_key in np.random.randint(low=0, high=n // 4, size=n // 16).tolist():
+                tree.add(key=this_key, value=-this_key)
+                bisect.insort_right(reference, this_key)
+            for this_key in np.random.randint(low=0, high=n // 4, size=n // 32).tolist():
+                idx = bisect.bisect_left(reference, this_key)
+                if idx < len(reference) and reference[idx] == this_key:
+                    mismatches += tree.remove(this_key).key != reference.pop(idx)
+                else:
+                    try:
+                        tree.remove(this_key)
+                        mismatches += 1
+                    except KeyError:
+                        pass
+            mismatches += [node.key for node in tree] != reference or tree.node_count != len(reference)
+            mismatches += [node.key for node in reversed(tree)] != reference[::-1]
+            mismatches += any(key != -value for key, value in tree.items())
+            errors.extend(check_btree(tree))
+        for this_key in (np.random.random(size=test_qty) * (n // 4 + 2) - 1).tolist():
+            idx = bisect.bisect_left(reference, this_key)
+            nearest = min(reference[max(0, idx - 1):idx + 1], key=lambda key: (abs(key - this_key), key))
+            mismatches += tree.find_node(this_key, nearest=True).key != nearest
+            mismatches += (tree.find_node(this_key) is not None) != (idx < len(reference) and reference[idx] == this_key)
+            mismatches += tree.rank(this_key) != idx or tree.count(round(this_key)) != reference.count(round(this_key))
+            lo, hi = sorted((this_key, this_key + np.random.randint(low=0, high=n // 8)))
+            mismatches += [node.key for node in tree.irange(lo, hi)] != reference[bisect.bisect_left(reference, lo):bisect.bisect_left(reference, hi)]
+            mismatches += [node.key for node in tree.irange(lo, hi, reverse=True)] != reference[bisect.bisect_left(reference, lo):bisect.bisect_left(reference, hi)][::-1]
+            mismatches += [key for key, _ in tree.items(lo, hi)] != reference[bisect.bisect_left(reference, lo):bisect.bisect_left(reference, hi)]
+        for kth in np.random.randint(low=-len(reference), high=len(reference), size=test_qty).tolist():
+            mismatches += tree.find_kth(kth).key != reference[kth]
+        while reference:
+            mismatches += tree.remove(reference.pop(np.random.randint(len(reference)))).key is None
+            if len(reference) % 64 == 0:
+                errors.extend(check_btree(tree))
+        print(f"order {order:3}: {mismatches} mismatches, empty after removing every key: {tree.node_count == 0 and tree.root is None}, "
+              f"errors: {errors[:3]}, {len(errors)} in total")
+
+    # Bulk load and add_many against adding one key at a time
+    keys = np.random.randint(low=0, high=10 * n, size=n)
+    built = bt.BT_BTree.from_keys(keys, values=keys, order=16)
+    added = bt.BT_BTree(order=16)
+    added.add_many(keys[:n // 8])
+    added.add_many(keys[n // 8:])
+    print(f"from_keys and add_many match sorted keys: {[node.key for node in built] == sorted(keys.tolist()) == [node.key for node in added]}, "
+          f"heights {built.height} and {added.height}")
+
+    # Time: lookups, nearest lookups, kth lookups and range scans against a red-black tree
+    keys = np.random.randint(low=0, high=10 * n_large, size=n_large)
+    queries = np.random.choice(keys, size=16 * test_qty).tolist()
+    ranks = np.random.randint(low=0, high=n_large, size=16 * test_qty).tolist()
+    ranges = [(lo, lo + 10 * 256) for lo in np.random.randint(low=0, high=10 * n_large, size=test_qty // 4).tolist()]
+    for tree_class in (bt.RB_Tree, bt.BT_BTree):
+        t_ini = time.perf_counter()
+        tree = tree_class()
+        for this_key in keys[:n_large // 4].tolist():
+            tree.add(key=this_key)
+        t_add = time.perf_counter() - t_ini
+        tree = tree_class.from_keys(keys)
+        gc.collect()
+        timings = []
+        for function in (lambda: [tree.find_node(this_key) for this_key in queries],
+                         lambda: [tree.find_node(this_key + 0.5, nearest=True) for this_key in queries],
+                         lambda: [tree.find_kth(kth) for kth in ranks]):
+            t_ini = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - t_ini) / len(queries))
+        t_ini = time.perf_counter()
+        scanned = sum(1 for lo, hi in ranges for _ in tree.irange(lo, hi))
+        t_range = (time.perf_counter() - t_ini) / scanned
+        t_ini = time.perf_counter()
+        sum(1 for lo, hi in ranges for _ in (tree.items(lo, hi) if tree_class is bt.BT_BTree else ((node.key, node.value) for node in tree.irange(lo, hi))))
+        t_items = (time.perf_counter() - t_ini) / scanned
+        print(f"{tree_class.__name__:8} {n_large} keys, height {tree.height:2}: add {t_add / (n_large // 4) * 1e6:5.2f}, "
+              f"find {timings[0] * 1e6:5.2f}, nearest {timings[1] * 1e6:5.2f}, kth {timings[2] * 1e6:5.2f} [us/query], "
+              f"range scan {t_range * 1e9:6.1f}, items {t_items * 1e9:6.1f} [ns/key]")
+
+def test_sliding_window(n:int=0, test_qty:int=0) -> None:
+    print(16 * '=')
+    print(f"Sliding window, {n} events")
+
+    # Quantile series against numpy.quantile of each window, including while the window fills
+    events = np.random.randint(low=0, high=64, size=n).astype(float)
+    qs = [0, 0.1, 0.5, 0.95, 1]
+    for size in (1, 2, 101, 1000):
+        expected = np.array([np.quantile(events[max(0, idx - size + 1):idx + 1], qs) for idx in range(n)])
+        for tree in (None, bt.BT_BTree(order=16), bt.BT_Tree()):
+            window = bt.BT_SlidingWindow(size=size, tree=tree)
+            series = np.array(window.quantile_series(events[:n // 2], q=qs))
+            stepped = []
+            for this_key in events[n // 2:].tolist():
+                window.add(this_key)
+                stepped.append(window.quantiles(qs))
+            error = np.abs(np.vstack((series, stepped)) - expected).max()
+            print(f"size {size:4}, {type(window.tree).__name__:8}: max error {error}, median {window.median() == np.median(events[-size:])}, "
+                  f"{len(window)} keys in window, {window.tree.node_count} in tree")
+
+    # Time: rolling median and 5%/95% quantiles against numpy.partition of each window. Only the steps with a full
+    # window are timed, the same steps for both; the window is filled beforehand.
+    events = np.random.random(size=16 * test_qty)
+    for size in (101, 1001, 10001):
+        if size > len(events):
+            continue
+        steps = len(events) - size + 1
+        for name, tree in (("RB_Tree", None), ("BT_BTree", bt.BT_BTree())):
+            window = bt.BT_SlidingWindow(size=size, tree=tree)
+            window.quantile_series(events[:size - 1], q=[0.05, 0.5, 0.95])
+            t_ini = time.perf_counter()
+            window.quantile_series(events[size - 1:], q=[0.05, 0.5, 0.95])
+            t_tree = (time.perf_counter() - t_ini) / steps
+            print(f"window {size:5}, {name:8}: {t_tree * 1e6:7.2f} [us/step]")
+        kths = [int(0.05 * (size - 1)), (size - 1) // 2, int(0.95 * (size - 1))]
+        t_ini = time.perf_counter()
+        for idx in range(size, len(events) + 1):
+            np.partition(events[idx - size:idx], kths)
+        t_partition = (time.perf_counter() - t_ini) / steps
+        print(f"window {size:5}, numpy.partition per window: {t_partition * 1e6:7.2f} [us/step]")
+
+def test_sharded(n:int=0, test_qty:int=0, n_large:int=0) -> None:
+    print(16 * '=')
+    print(f"Sharded tree, {n} keys")
+
+    # Routed and scatter-gathered queries against a sorted list, including keys repeated across chunk boundaries
+    keys = np.random.randint(low=0, high=n, size=4 * n)
+    reference = sorted(keys.tolist())
+    with bt.BT_ShardedTree.from_keys(keys, values=-keys, shards=4, workers=2) as tree:
+        queries = (np.random.random(size=4 * test_qty) * (n + 2) - 1).tolist()
+        mismatches = 0
+        for this_key in queries[:test_qty]:
+            idx = bisect.bisect_left(reference, this_key)
+            nearest = min(reference[max(0, idx - 1):idx + 1], key=lambda key: (abs(key - this_key), key))
+            mismatches += tree.find_node(this_key, nearest=True).key != nearest or tree.rank(this_key) != idx
+            ceiling = tree.ceiling(this_key)
+            mismatches += (ceiling is None) != (idx == len(reference)) or (ceiling is not None and ceiling.key != reference[idx])
+        tree._SCATTER_MIN = 0
+        for nearest in (False, True):
+            scattered = tree.find_many(queries, nearest=nearest)
+            mismatches += any((node is None) != (tree.find_node(this_key, nearest=nearest) is None) or
+                              (node is not None and node.key != tree.find_node(this_key, nearest=nearest).key)
+                              for node, this_key in zip(scattered, queries))
+        for kth in np.random.randint(low=-len(reference), high=len(reference), size=test_qty).tolist():
+            node = tree.find_kth(kth)
+            mismatches += node.key != reference[kth] or node.value != -reference[kth]
+        mismatches += [node.key for node in tree] != reference or tree.count(reference[n]) != reference.count(reference[n])
+        print(f"{len(tree.shards)} shards, bounds {tree.bounds}: {mismatches} mismatches")
+
+    # Time: build and batch lookups across worker counts, against one tree in this process
+    keys = np.random.randint(low=0, high=10 * n_large, size=n_large)
+    queries = np.random.choice(keys, size=64 * test_qty)
+    t_ini = time.perf_counter()
+    tree = bt.BT_Tree.from_keys(keys)
+    t_build = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    tree.find_many(queries)
+    t_find = time.perf_counter() - t_ini
+    print(f"{os.cpu_count()} cores, one BT_Tree: build {t_build:6.3f} [s], find_many {len(queries) / t_find / 1e3:7.1f} [k queries/s]")
+    for workers in (1, 2, 4, 8):
+        t_ini = time.perf_counter()
+        with bt.BT_ShardedTree.from_keys(keys, workers=workers) as tree:
+            t_build = time.perf_counter() - t_ini
+            tree.find_many(queries)  # start the workers and fault in the mapped pages
+            t_ini = time.perf_counter()
+            tree.find_many(queries)
+            t_find = time.perf_counter() - t_ini
+        print(f"{workers} workers: build {t_build:6.3f} [s], find_many {len(queries) / t_find / 1e3:7.1f} [k queries/s]")
+
+def test_render(n:int=0, n_large:int=0) -> None:
+    print(16 * '=')
+    print(f"Render, {n} keys")
+
+    # Cached and uncached renders of twin trees, through adds, removes and bulk changes
+    for tree_class in (bt.BT_Tree, bt.RB_Tree, bt.BT_ArrayTree):
+        plain = tree_class()
+        cached = tree_class()
+        cached.enable_render_cache()
+        mismatches = 0
+        for idx, this_key in enumerate(np.random.randint(low=0, high=n, size=n // 4).tolist()):
+            if idx % 16 == 15 and plain.find_node(this_key) is not None:
+                plain.remove(this_key)
+                cached.remove(this_key)
+            elif idx % 256 == 255:
+                plain.add_many(range(this_key, this_key + 8))
+                cached.add_many(range(this_key, this_key + 8))
+            else:
+                plain.add(key=this_key, value=idx)
+                cached.add(key=this_key, value=idx)
+            settings = ({"max_depth": 3}, {"max_depth": -1, "print_key": True}, {"max_depth": -1, "max_nodes": 20, "inverted": True})[idx % 3]
+            mismatches += plain.render(**settings) != cached.render(**settings)
+        stream = io.StringIO()
+        cached.render(file=stream, max_depth=-1)
+        print(f"{tree_class.__name__:12}: {mismatches} mismatches, full render of {cached.node_count} nodes streams "
+              f"{stream.getvalue().count(chr(10))} lines")
+
+    # Time: bounded views of a large tree, then re-rendering after each add with and without the cache
+    tree = bt.RB_Tree.from_keys(np.random.randint(low=0, high=10 * n_large, size=n_large))
+    for settings in ({"max_depth": 4}, {"max_depth": 8}, {"max_depth": -1, "max_nodes": 1000}):
+        t_ini = time.perf_counter()
+        lines = tree.render(print_key=True, print_val=False, **settings)
+        print(f"{n_large} nodes, {settings}: {len(lines)} lines, {(time.perf_counter() - t_ini) * 1e3:6.2f} [ms]")
+    with contextlib.redirect_stdout(io.StringIO()):
+        t_ini = time.perf_counter()
+        tree.print_branch(tree.root.left_child, print_key=True, print_val=False, max_print_height=6)
+        t_branch = time.perf_counter() - t_ini
+    print(f"print_branch of {tree.root.left_child.node_count} nodes, 6 levels: {t_branch * 1e3:6.2f} [ms]")
+    added = np.random.randint(low=0, high=10 * n_large, size=64).tolist()
+    for enabled in (False, True):
+        if enabled:
+            tree.enable_render_cache()
+        tree.render(print_key=True, print_val=False, max_depth=-1, max_nodes=1000)
+        t_ini = time.perf_counter()
+        for this_key in added:
+            tree.add(key=this_key)
+            tree.render(print_key=True, print_val=False, max_depth=-1, max_nodes=1000)
+        t_render = (time.perf_counter() - t_ini) / len(added)
+        print(f"add and render 1000 nodes, cache {enabled!s:5}: {t_render * 1e3:6.2f} [ms]")
+
 def test_find_speed(tree:bt.BT_Tree=None, test_qty:int=0, keys:np.ndarray=None):
     # print(f"{k}th element found by Numpy: {np.partition(keys, kth=k)[k]}")
 
@@ -121,7 +1618,41 @@ def test_find_speed(tree:bt.BT_Tree=None, test_qty:int=0, keys:np.ndarray=None):
     print(f"average run time to find {k}th element among {keys.shape[0]} elements over {test_qty} trials:\n")
     print(f"Numpy partition     : {t_tot_np / test_qty:11.9f}  [s]")
     print(f"Binary Tree Search  : {t_tot_bt / test_qty:11.9f}  [s]")
-    pass
+
+    # Batch queries: per-call loop vs. find_many / find_kth_many vs. NumPy
+    queries = np.random.randint(low=0, high=10 * keys.shape[0], size=test_qty)
+    ranks = np.random.randint(low=0, high=keys.shape[0], size=test_qty)
+
+    t_ini = time.perf_counter()
+    loop_nodes = [tree.find_node(this_key, nearest=True) for this_key in queries.tolist()]
+    t_loop_find = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    batch_nodes = tree.find_many(queries, nearest=True)
+    t_batch_find = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    sorted_keys = np.sort(keys)
+    np.searchsorted(sorted_keys, queries)
+    t_np_find = time.perf_counter() - t_ini
+
+    t_ini = time.perf_counter()
+    loop_kth = [tree.find_kth(rank) for rank in ranks.tolist()]
+    t_loop_kth = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    batch_kth = tree.find_kth_many(ranks)
+    t_batch_kth = time.perf_counter() - t_ini
+    t_ini = time.perf_counter()
+    np.partition(keys, ranks)
+    t_np_kth = time.perf_counter() - t_ini
+
+    exact_match = tree.find_many(queries) == [tree.find_node(this_key) for this_key in queries.tolist()]
+    print(f"\nbatch of {test_qty} queries; find_many matches find_node: {batch_nodes == loop_nodes and exact_match}, "
+          f"find_kth_many matches find_kth: {batch_kth == loop_kth}, "
+          f"matches numpy.sort: {[node.key for node in batch_kth] == sorted_keys[ranks].tolist()}\n")
+    print(f"{'':24} {'find nearest [s]':>16} {'find kth [s]':>13}")
+    print(f"{'Binary Tree loop':24} {t_loop_find:16.9f} {t_loop_kth:13.9f}")
+    print(f"{'Binary Tree batch':24} {t_batch_find:16.9f} {t_batch_kth:13.9f}")
+    print(f"{'Numpy sort+searchsorted':24} {t_np_find:16.9f}")
+    print(f"{'Numpy partition':24} {'':16} {t_np_kth:13.9f}")
 
 
 if __name__ == '__main__':